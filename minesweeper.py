@@ -1,5 +1,13 @@
 import itertools
 import random
+import sys
+
+import numpy as np
+from z3 import Bool, Not, PbEq, Solver, is_true, sat, unsat
+
+# Print the AI's knowledge as it is inferred, for debugging
+# The checks are compiled out entirely when running under python -O
+DEBUG = False
 
 
 class Minesweeper():
@@ -12,23 +20,24 @@ class Minesweeper():
         # Set initial width, height, and number of mines
         self.height = height
         self.width = width
-        self.mines = set()
 
         # Initialize an empty field with no mines
-        self.board = []
-        for i in range(self.height):
-            row = []
-            for j in range(self.width):
-                row.append(False)
-            self.board.append(row)
-
-        # Add mines randomly
-        while len(self.mines) != mines:
-            i = random.randrange(height)
-            j = random.randrange(width)
-            if not self.board[i][j]:
-                self.mines.add((i, j))
-                self.board[i][j] = True
+        self.board = np.zeros((height, width), dtype=bool)
+
+        # Add mines randomly, sampling distinct flat indices without retries
+        idx = random.sample(range(height * width), mines)
+        self.board.flat[idx] = True
+        self.mines = {divmod(k, width) for k in idx}
+
+        # The board never changes once mines are placed, so count every
+        # cell's neighboring mines up front, convolving the board with a
+        # 3x3 ring of ones as a sum of the eight shifted windows
+        padded = np.pad(self.board, 1).astype(np.intp)
+        self._counts = sum(
+            padded[1 + di:1 + di + height, 1 + dj:1 + dj + width]
+            for di in (-1, 0, 1) for dj in (-1, 0, 1)
+            if di or dj
+        )
 
         # At first, player has found no mines
         self.mines_found = set()
@@ -38,19 +47,17 @@ class Minesweeper():
         Prints a text-based representation
         of where mines are located.
         """
-        for i in range(self.height):
-            print("--" * self.width + "-")
-            for j in range(self.width):
-                if self.board[i][j]:
-                    print("|X", end="")
-                else:
-                    print("| ", end="")
-            print("|")
-        print("--" * self.width + "-")
+        border = "--" * self.width + "-"
+        lines = []
+        for row in self.board.tolist():
+            lines.append(border)
+            lines.append("".join("|X" if c else "| " for c in row) + "|")
+        lines.append(border)
+        sys.stdout.write("\n".join(lines) + "\n")
 
     def is_mine(self, cell):
         i, j = cell
-        return self.board[i][j]
+        return bool(self.board[i, j])
 
     def nearby_mines(self, cell):
         """
@@ -59,23 +66,16 @@ class Minesweeper():
         not including the cell itself.
         """
 
-        # Keep count of nearby mines
-        count = 0
-
-        # Loop over all cells within one row and column
-        for i in range(cell[0] - 1, cell[0] + 2):
-            for j in range(cell[1] - 1, cell[1] + 2):
-
-                # Ignore the cell itself
-                if (i, j) == cell:
-                    continue
-
-                # Update count if cell in bounds and is mine
-                if 0 <= i < self.height and 0 <= j < self.width:
-                    if self.board[i][j]:
-                        count += 1
+        i, j = cell
+        return int(self._counts[i, j])
 
-        return count
+    def nearby_mines_all(self):
+        """
+        Returns a height x width array with the number of mines
+        that are within one row and column of each cell,
+        not including the cell itself.
+        """
+        return self._counts.copy()
 
     def won(self):
         """
@@ -84,48 +84,94 @@ class Minesweeper():
         return self.mines_found == self.mines
 
 
+def cells_of(cells):
+    """
+    Yields the flat index of every cell in a bitmask of cells.
+    """
+    while cells:
+        low = cells & -cells
+        yield low.bit_length() - 1
+        cells ^= low
+
+
+def popcount(cells):
+    """
+    Returns the number of cells in a bitmask of cells.
+    """
+    return bin(cells).count("1")
+
+
 class Sentence():
     """
     Logical statement about a Minesweeper game
     A sentence consists of a set of board cells,
     and a count of the number of those cells which are mines.
+    The set of cells is a bitmask with bit i * width + j set for cell (i, j).
     """
 
+    __slots__ = ("cells", "count", "_size", "_hash")
+
     def __init__(self, cells, count):
-        self.cells = set(cells)
+        self.cells = cells
         self.count = count
+        self._size = popcount(cells)
+        self._hash = None
 
     def __eq__(self, other):
         return self.cells == other.cells and self.count == other.count
 
+    def __hash__(self):
+        if self._hash is None:
+            self._hash = hash(self.key())
+        return self._hash
+
+    def key(self):
+        """
+        Returns a hashable snapshot of the sentence's cells and count.
+        """
+        return (self.cells, self.count)
+
+    def __len__(self):
+        return self._size
+
     def __str__(self):
-        return f"{self.cells} = {self.count}"
+        return f"{set(cells_of(self.cells))} = {self.count}"
 
     def known_mines(self):
         """
-        Returns the set of all cells in self.cells known to be mines.
+        Returns the bitmask of all cells in self.cells known to be mines.
         """
-        if len(self.cells) == self.count:
+        if self._size == self.count:
             return self.cells
 
     def known_safes(self):
         """
-        Returns the set of all cells in self.cells known to be safe.
+        Returns the bitmask of all cells in self.cells known to be safe.
         """
         if self.count == 0:
             return self.cells
 
+    def is_determined(self):
+        """
+        Returns True if the sentence has cells that are all known to be
+        mines or all known to be safe.
+        """
+        return bool(self.cells) and (self.count == 0 or self.count == self._size)
+
     def mark_mine(self, cell):
         """
         Updates internal knowledge representation given the fact that
         a cell is known to be a mine.
         """
         # If the cell is in the sentence, remove the cell
-        if cell in self.cells:
-            self.cells.remove(cell)
+        bit = 1 << cell
+        if self.cells & bit:
+            self.cells ^= bit
+            self._size -= 1
             
             # Decrease the count of the sentence that had the mine
             self.count -= 1
+            self._hash = None
             
     def mark_safe(self, cell):
         """
@@ -133,10 +179,12 @@ class Sentence():
         a cell is known to be safe.
         """
         # If the cell is in the sentence, remove the cell
-        if cell in self.cells:
-            self.cells.remove(cell)
-        
-        
+        bit = 1 << cell
+        if self.cells & bit:
+            self.cells ^= bit
+            self._size -= 1
+            self._hash = None
+
 
 class MinesweeperAI():
     """
@@ -149,42 +197,276 @@ class MinesweeperAI():
         self.height = height
         self.width = width
 
+        # Cells are tracked internally as flat indices i * width + j,
+        # and only converted back to (i, j) tuples at the public boundary
+
         # Keep track of which cells have been clicked on
-        self.moves_made = set()
+        self._moves_made = set()
 
         # Keep track of cells known to be safe or mines
-        self.mines = set()
-        self.safes = set()
+        self._mines = set()
+        self._safes = set()
+
+        # Neighbors of every cell, as flat indices, indexed by flat index
+        self._neighbors = [
+            tuple(
+                (i + di) * width + (j + dj)
+                for di in (-1, 0, 1) for dj in (-1, 0, 1)
+                if (di or dj) and 0 <= i + di < height and 0 <= j + dj < width
+            )
+            for i in range(height) for j in range(width)
+        ]
+
+        # Flags the cells a random move must avoid: moves made and known mines
+        self._excluded = np.zeros(height * width, dtype=bool)
+
+        # Sentences about the game known to be true, keyed by id
+        self.knowledge = {}
+
+        # Sentences in the knowledge base keyed by their contents, kept up
+        # to date as cells are marked so that membership tests hash instead
+        # of scanning and duplicates are caught as soon as they appear
+        self._knowledge_keys = {}
+
+        # Ids of the sentences in the knowledge base that contain each cell
+        self._cell_index = {}
+
+        # Ids of sentences whose cells are all known mines or all known safes,
+        # waiting for those cells to be marked
+        self._determined = set()
+
+        # Ids of sentences emptied or duplicated by marking a mine or safe,
+        # waiting to be dropped from the knowledge base
+        self._dropped = set()
+
+        # SAT solver over one Bool per cell, kept for the whole game; marking
+        # a cell never makes an earlier sentence false, so constraints are
+        # only ever added to it
+        self._solver = Solver()
+        self._variables = {}
+
+        # Ids of sentences added, and cells with a Bool marked, since the
+        # solver last ran, waiting to be handed to it on its next run
+        self._unencoded = set()
+        self._unasserted = set()
+
+    def _encode(self, cell):
+        """
+        Returns the flat index of an (i, j) cell.
+        """
+        i, j = cell
+        return i * self.width + j
 
-        # List of sentences about the game known to be true
-        self.knowledge = []
+    def _decode(self, index):
+        """
+        Returns the (i, j) cell of a flat index.
+        """
+        return divmod(index, self.width)
+
+    @property
+    def moves_made(self):
+        """
+        Returns the set of (i, j) cells that have been clicked on.
+        """
+        return {self._decode(c) for c in self._moves_made}
+
+    @property
+    def mines(self):
+        """
+        Returns the set of (i, j) cells known to be mines.
+        """
+        return {self._decode(c) for c in self._mines}
+
+    @property
+    def safes(self):
+        """
+        Returns the set of (i, j) cells known to be safe.
+        """
+        return {self._decode(c) for c in self._safes}
 
     def mark_mine(self, cell):
         """
-        Marks a cell as a mine, and updates all knowledge
-        to mark that cell as a mine as well.
+        Marks a cell (given as a flat index) as a mine, and updates
+        all knowledge to mark that cell as a mine as well.
         If the cell has already been marked, do nothing
         """
-        if cell not in self.mines:
-            self.mines.add(cell)
+        if cell not in self._mines:
+            self._mines.add(cell)
+            self._excluded[cell] = True
+            if cell in self._variables:
+                self._unasserted.add(cell)
             
-        # Check the knowledge to update sentences that only contain neighbors
-        for sentence in self.knowledge:
+        # Update only the sentences that contain the cell, which no longer will
+        for key in self._cell_index.pop(cell, ()):
+            sentence = self.knowledge[key]
+            old_key = sentence.key()
             sentence.mark_mine(cell)
-                    
+            self._sentence_changed(key, sentence, old_key)
 
     def mark_safe(self, cell):
         """
-        Marks a cell as safe, and updates all knowledge
-        to mark that cell as safe as well.
+        Marks a cell (given as a flat index) as safe, and updates
+        all knowledge to mark that cell as safe as well.
         If the cell has already been marked, do nothing
         """
-        if cell not in self.safes:
-            self.safes.add(cell)
+        if cell not in self._safes:
+            self._safes.add(cell)
+            if cell in self._variables:
+                self._unasserted.add(cell)
             
-        # Check each sentence in the knowledge for the safe cell and remove the cell 
-        for sentence in self.knowledge:
+        # Remove the safe cell from only the sentences that contain it
+        for key in self._cell_index.pop(cell, ()):
+            sentence = self.knowledge[key]
+            old_key = sentence.key()
             sentence.mark_safe(cell)
+            self._sentence_changed(key, sentence, old_key)
+
+    def _sentence_changed(self, key, sentence, old_key):
+        """
+        Moves a sentence changed by marking a cell to its new key in
+        self._knowledge_keys, queueing it to be dropped if it was emptied
+        or now duplicates another sentence, or to have its cells marked
+        if it is now determined.
+        """
+        if key in self._dropped:
+            return
+        if self._knowledge_keys.get(old_key) is sentence:
+            del self._knowledge_keys[old_key]
+
+        if not sentence.cells or sentence.key() in self._knowledge_keys:
+            self._dropped.add(key)
+        else:
+            self._knowledge_keys[sentence.key()] = sentence
+            if sentence.is_determined():
+                self._determined.add(key)
+
+    def _add_sentence(self, sentence):
+        """
+        Adds a sentence to the knowledge base and indexes it by its cells.
+        """
+        key = id(sentence)
+        self.knowledge[key] = sentence
+        self._knowledge_keys[sentence.key()] = sentence
+        for c in cells_of(sentence.cells):
+            self._cell_index.setdefault(c, set()).add(key)
+        if not sentence.cells:
+            self._dropped.add(key)
+        else:
+            self._unencoded.add(key)
+            if sentence.is_determined():
+                self._determined.add(key)
+
+    def _mark_determined(self):
+        """
+        Marks the cells of every determined sentence as mines or safes,
+        following on to the sentences that marking determines in turn.
+        """
+        while self._determined:
+            sentence = self.knowledge.get(self._determined.pop())
+            if sentence is None:
+                continue
+
+            # The bitmasks are ints, so marking cannot change them under the loop
+            mines = sentence.known_mines()
+            if mines:
+                for c in cells_of(mines):
+                    self.mark_mine(c)
+
+            safes = sentence.known_safes()
+            if safes:
+                for c in cells_of(safes):
+                    self.mark_safe(c)
+
+    def _prune_knowledge(self):
+        """
+        Drops the sentences queued since the last prune, which are either
+        empty or duplicates of another sentence, from the knowledge base.
+        """
+        for key in self._dropped:
+            sentence = self.knowledge.pop(key)
+            if self._knowledge_keys.get(sentence.key()) is sentence:
+                del self._knowledge_keys[sentence.key()]
+            for c in cells_of(sentence.cells):
+                self._cell_index[c].discard(key)
+        self._dropped.clear()
+
+    def _variable(self, cell):
+        """
+        Returns the solver's Bool for whether a cell is a mine,
+        creating it, along with any fact already known about the cell.
+        """
+        if cell not in self._variables:
+            v = self._variables[cell] = Bool(f"cell_{cell}")
+
+            # Sentences inferred before a cell was determined may still mention it
+            if cell in self._mines:
+                self._solver.add(v)
+            elif cell in self._safes:
+                self._solver.add(Not(v))
+        return self._variables[cell]
+
+    def _solve_knowledge(self):
+        """
+        Marks every cell that the knowledge base as a whole forces to be
+        a mine or safe, including those that subset inference misses,
+        by checking each undetermined cell with the SAT solver.
+        """
+        # Nothing learned since the last run cannot force anything new
+        if not self._unencoded and not self._unasserted:
+            return
+
+        # Group the sentences that share cells; a sentence sharing none
+        # forces nothing unless it is determined, which is handled already
+        groups = []
+        for sentence in self.knowledge.values():
+            cells, size = sentence.cells, 1
+            rest = []
+            for group in groups:
+                if group[0] & cells:
+                    cells |= group[0]
+                    size += group[1]
+                else:
+                    rest.append(group)
+            rest.append((cells, size))
+            groups = rest
+        frontier = 0
+        for cells, size in groups:
+            if size > 1:
+                frontier |= cells
+        if not frontier:
+            return
+
+        # Hand the solver what was learned since it last ran, encoding each new
+        # sentence in its current form, as marking since has only shrunk it
+        for c in self._unasserted:
+            v = self._variables[c]
+            self._solver.add(v if c in self._mines else Not(v))
+        for key in self._unencoded:
+            sentence = self.knowledge.get(key)
+            if sentence is not None and sentence.cells:
+                terms = [(self._variable(c), 1) for c in cells_of(sentence.cells)]
+                self._solver.add(PbEq(terms, sentence.count))
+        self._unencoded.clear()
+        self._unasserted.clear()
+
+        if self._solver.check() != sat:
+            return
+
+        # A cell is forced only if the opposite of its value in some model is unsatisfiable
+        model = self._solver.model()
+        for c in cells_of(frontier):
+            v = self._variables[c]
+            if is_true(model.eval(v, model_completion=True)):
+                if self._solver.check(Not(v)) == unsat:
+                    self.mark_mine(c)
+            elif self._solver.check(v) == unsat:
+                self.mark_safe(c)
+
+        self._mark_determined()
+        self._prune_knowledge()
+
+        # Everything marked above already follows from the solver's constraints
+        self._unasserted.clear()
 
     def add_knowledge(self, cell, count):
         """
@@ -202,76 +484,67 @@ class MinesweeperAI():
                if they can be inferred from existing knowledge
         """
         
-        # Used for printing information used for debugging
-        DEBUG = False
-        
-        def generate_new_knowledge(self, new_sentences: list):
+        def generate_new_knowledge(self, new_sentences: dict):
             """
             Compare each sentence in the knowledge base to each other to see if they are subsets of each other
             If so, generate a new sentence by the rule: set2 - set1 = count2 - count1
             Store the new sentences in new_sentences
             """
-            for s1 in tuple(self.knowledge):
-                for s2 in tuple(self.knowledge):
-                    if s1 != s2 and s1.count != 0 and s2.count != 0:
-                        
-                        if ((s2.cells).issubset(s1.cells)):
-                            temp = Sentence((s1.cells).difference(s2.cells), (s1.count-s2.count))
-                            if temp not in new_sentences and temp not in self.knowledge and temp.cells != set():
-                                new_sentences.append(temp) 
-                                
-                        if ((s1.cells).issubset(s2.cells)):
-                            temp = Sentence((s2.cells).difference(s1.cells), (s2.count-s1.count))
-                            if temp not in new_sentences and temp not in self.knowledge and temp.cells != set():
-                                new_sentences.append(temp)       
+            # Only a strictly smaller sentence can be a proper subset, so sort the
+            # sentences with mines by size and compare each to those before it
+            sentences = sorted((s for s in self.knowledge.values() if s.count != 0), key=len)
+            for s1 in sentences:
+                for s2 in sentences:
+                    if len(s2) >= len(s1):
+                        break
+                    
+                    if (s1.cells & s2.cells) == s2.cells:
+                        temp = Sentence(s1.cells ^ s2.cells, (s1.count-s2.count))
+                        if temp not in new_sentences and temp.key() not in self._knowledge_keys:
+                            new_sentences[temp] = None 
                
         # Mark the cell as a move that has been made
-        self.moves_made.add(cell)
+        index = self._encode(cell)
+        self._moves_made.add(index)
+        self._excluded[index] = True
         
         # Mark the cell as safe
-        self.mark_safe(cell)
+        self.mark_safe(index)
+        self._prune_knowledge()
         
         # Generate a new sentence based on value of 'cell' and 'count'
         # Create count_adjuster to modify our count value based on amount of mines already found around the cell
         count_adjuster = 0
-        temp_set = set()
+        temp_cells = 0
         
-        # Generate the neighboring cells from the marked safe cell to create a sentence
-        for i in range(-1,2):
-            for j in range(-1,2):
-                
-                # Create a neighboring cell
-                new_cell = (cell[0]+i, cell[1]+j)
-                
-                # Checking if the neighbor is in bounds
-                # Add the neighbor, if it is undetermined, to a set that will create a new sentence
-                # Adjust the count if the neighbor is already known to be a mine
-                if (((new_cell[0] <= self.height-1) and (new_cell[0] >= 0)) and ((new_cell[1] <= self.width-1) and (new_cell[1] >= 0))):
-                    if new_cell not in self.safes:
-                        if new_cell not in self.mines:
-                            temp_set.add(new_cell)
-                        else:
-                            count_adjuster += 1
+        # Add each neighbor of the marked safe cell, if it is undetermined, to the new sentence
+        # Adjust the count if the neighbor is already known to be a mine
+        for new_cell in self._neighbors[index]:
+            if new_cell not in self._safes:
+                if new_cell not in self._mines:
+                    temp_cells |= 1 << new_cell
+                else:
+                    count_adjuster += 1
                             
         # The new sentence will be used to create newer sentences and will be added to the knwoeldge base         
-        new_sentences = [Sentence(temp_set, count-count_adjuster)] 
+        new_sentences = {Sentence(temp_cells, count-count_adjuster): None}
         
         
-        if DEBUG:
+        if __debug__ and DEBUG:
             x = 0
         
         # Add any new sentences if they can be inferred
         while True:
             
             # Test one sentence from the new sentences
-            test_sentence = new_sentences.pop()
+            test_sentence, _ = new_sentences.popitem()
             
             # Check if the test sentence is already in the knowledge base
             # Add the test sentence to the knowledge base 
             # Generate new sentences if they can be inferred form the knowledge base
-            if test_sentence not in self.knowledge:
+            if test_sentence.key() not in self._knowledge_keys:
                 
-                self.knowledge.append(test_sentence)
+                self._add_sentence(test_sentence)
                 
                 generate_new_knowledge(self, new_sentences)   
                 
@@ -279,52 +552,27 @@ class MinesweeperAI():
                     
                     # Mark any additional cells as safe or as mines
                     # while keeping track if there are any new mines or safes detected
-                    num_mines = len(self.mines)
-                    num_safes = len(self.safes)
+                    num_mines = len(self._mines)
+                    num_safes = len(self._safes)
                     
-                    for s in self.knowledge:    
-                        
-                        mines = s.known_mines()
-                        if mines:
-                            for c in tuple(mines):
-                                self.mark_mine(c)
-                        
-                        safes = s.known_safes()
-                        if safes:    
-                            for c in tuple(safes):
-                                self.mark_safe(c)
+                    self._mark_determined()
                     
-                    # Remove any sentence that is empty after checking for mines and safes
-                    for s in tuple(self.knowledge):   
-                        if s.cells == set():
-                            self.knowledge.remove(s)
-                    
-                    for s in tuple(new_sentences):
-                        if s.cells == set():
-                            new_sentences.remove(s)
-                            
-                    # Remove any duplicate sentences after checking for mines and safes
-                    for s in tuple(self.knowledge):
-                        if self.knowledge.count(s) > 1:
-                            self.knowledge.remove(s)
-                    
-                    for s in tuple(new_sentences):
-                        if new_sentences.count(s) > 1:
-                            new_sentences.remove(s)
+                    # Remove any sentence that is empty or duplicated after checking for mines and safes
+                    self._prune_knowledge()
                     
                     # If the knowledge base has changed by finding new mines or safes,
                     # add any new sentences if they can be inferred from the changed knowledge base
-                    if (num_mines > len(self.mines)) or (num_safes > len(self.safes)):
+                    if (num_mines > len(self._mines)) or (num_safes > len(self._safes)):
                         
                         generate_new_knowledge(self, new_sentences)
         
                     else:
                         break
                     
-            if DEBUG:               
+            if __debug__ and DEBUG:               
                 x += 1
                 print("Temp Knowledge", x)
-                for s in self.knowledge:
+                for s in self.knowledge.values():
                     print(s)
                 print("New_Sentences", x)
                 for s in new_sentences:
@@ -336,9 +584,13 @@ class MinesweeperAI():
             if len(new_sentences) == 0:
                 break
         
-        if DEBUG:  
+        # If subset inference left no safe move, check what the whole knowledge base forces
+        if not self._safes.difference(self._moves_made):
+            self._solve_knowledge()
+        
+        if __debug__ and DEBUG:  
             print("\nFinal Knowledge Base")
-            for s in self.knowledge:
+            for s in self.knowledge.values():
                 print(s)
             print("Safes:", self.safes.difference(self.moves_made))
             print("Mines:", self.mines)
@@ -357,10 +609,10 @@ class MinesweeperAI():
         
         # Create a set of all moves that haven't been chosen and are safe
         
-        available_moves = self.safes.difference(self.moves_made)
+        available_moves = self._safes.difference(self._moves_made)
         
         # Return a random safe move if there are safe moves available
-        return random.choice(list(available_moves)) if available_moves else None
+        return self._decode(random.choice(list(available_moves))) if available_moves else None
         
         
 
@@ -372,7 +624,7 @@ class MinesweeperAI():
             2) are not known to be mines
         """
         # Create a set of all moves that haven't been chosen and aren't mines
-        available_moves = [(i,j) for i in range(self.height) for j in range(self.width) if ((i,j) not in self.moves_made and (i,j) not in self.mines)]
+        available_moves = np.flatnonzero(~self._excluded)
         
         # Return a random move if there are moves available
-        return random.choice(available_moves) if available_moves else None
+        return self._decode(int(random.choice(available_moves))) if available_moves.size else None